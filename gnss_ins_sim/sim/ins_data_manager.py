@@ -424,12 +424,14 @@ class InsDataMgr(object):
                         err_stat[i][j] = \
                             sim_data.convert_unit(err_stat[i][j],\
                                                   self.__err[err_data_name].units,\
-                                                  self.__err[err_data_name].output_units)
+                                                  self.__err[err_data_name].output_units,\
+                                                  copy=False)
                 else:
                     err_stat[i] = \
                             sim_data.convert_unit(err_stat[i],\
                                                   self.__err[err_data_name].units,\
-                                                  self.__err[err_data_name].output_units)
+                                                  self.__err[err_data_name].output_units,\
+                                                  copy=False)
         err_stat['units'] = str(self.__err[err_data_name].output_units)
         return err_stat
 
@@ -519,8 +521,9 @@ class InsDataMgr(object):
         if lla == 0:
             err = x - r
             if angle:
-                for j in range(len(err.flat)):
-                    err.flat[j] = attitude.angle_range_pi(err.flat[j])
+                # wrap to [-pi, pi) in one vectorized pass instead of calling
+                # attitude.angle_range_pi once per element
+                err = np.mod(err + math.pi, attitude.TWO_PI) - math.pi
         else:
             # convert x and r to ECEF first
             x_ecef = geoparams.lla2ecef_batch(x)
@@ -11,7 +11,6 @@ import os
 import time
 import math
 import numpy as np
-import matplotlib.pyplot as plt
 from .ins_data_manager import InsDataMgr
 from .ins_algo_manager import InsAlgoMgr
 from ..pathgen import pathgen
@@ -290,6 +289,7 @@ class Sim(object):
                 is_angle = self.interested_error[data] == 'angle'
             self.dmgr.plot(data, keys, is_angle, opt, extra_opt)
         # show figures
+        import matplotlib.pyplot as plt
         plt.show()
 
     def __summary(self, data_dir, data_saved, err_stats_start=0, extra_opt=''):
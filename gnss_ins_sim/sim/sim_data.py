@@ -7,13 +7,53 @@ Created on 2017-12-19
 @author: dongxiaoguang
 """
 
+import functools
 import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
-from mpl_toolkits.mplot3d import Axes3D
 from ..attitude import attitude
 
+# numba is optional. If it is installed, large 2D arrays are scaled by a
+# compiled parallel kernel, otherwise the numpy broadcast path is used.
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+    @njit(parallel=True, cache=True, fastmath=True)
+    def _scale_2d_jit(x, scale):
+        '''
+        Scale columns of a 2D array in place, x[:, j] *= scale[j].
+        Zero scales mean the corresponding column needs no conversion.
+        '''
+        for i in prange(x.shape[0]):
+            for j in range(scale.shape[0]):
+                if scale[j] != 0.0:
+                    x[i, j] *= scale[j]
+
+# a 2D array with at least this many elements is scaled by the numba kernel
+_JIT_MIN_SIZE = 10000
+
+# scale factors of supported unit conversions, keyed by (src_unit, dst_unit).
+# Pairs not in this table get a scale of 0.0, which means no conversion.
+_UNIT_SCALE = {('deg', 'rad'): attitude.D2R,
+               ('deg/s', 'rad/s'): attitude.D2R,
+               ('deg/hr', 'rad/s'): attitude.D2R / 3600.0,
+               ('rad', 'deg'): 1.0 / attitude.D2R,
+               ('rad/s', 'deg/s'): 1.0 / attitude.D2R,
+               ('rad/s', 'deg/hr'): 3600.0 / attitude.D2R}
+# integer code of each convertible unit. Units not in this table get code 0
+# and are never converted, so comparing codes replaces comparing strings.
+_UNIT_CODE = {'deg': 1, 'rad': 2, 'deg/s': 3, 'rad/s': 4, 'deg/hr': 5}
+# 2D scale lookup table indexed by (src_code, dst_code), built from _UNIT_SCALE
+_SCALE_TBL = np.zeros((len(_UNIT_CODE)+1, len(_UNIT_CODE)+1))
+for _units, _scale in _UNIT_SCALE.items():
+    _SCALE_TBL[_UNIT_CODE[_units[0]], _UNIT_CODE[_units[1]]] = _scale
+del _units, _scale
+
 class Sim_data(object):
     '''
     Simulation data
@@ -21,7 +61,7 @@ class Sim_data(object):
     def __init__(self, name, description,\
                  units=None, output_units=None,\
                  plottable=True, logx=False, logy=False,\
-                 grid='on', legend=None):
+                 grid='on', legend=None, dtype=None):
         '''
         Set up data properties and plot properties. All data are stored in a dict (or a scalr or
         a numpy array): self.data.
@@ -43,6 +83,9 @@ class Sim_data(object):
             grid: if this is not 'off', it will be changed to 'on'
             legend: tuple or list of strings to specify legend of data.
                 The length of units is the same as columns of each set of data in self.data.
+            dtype: numpy dtype the data are stored in, e.g. np.float32 to halve
+                memory traffic when full float64 precision is not needed for
+                output. If this is None, data are stored as they come in.
         '''
         self.name = name
         self.description = description
@@ -71,6 +114,7 @@ class Sim_data(object):
         if grid.lower() == 'off':
             self.grid = grid
         self.legend = legend
+        self.dtype = dtype
         '''
         each item in the data should be either scalar or numpy.array of size(n, dim),
         or a dict of the above two, dict keys are like 0, 1, 2, 3, ...
@@ -78,6 +122,83 @@ class Sim_data(object):
         att_quat is nx4, allan_t is (n,)
         '''
         self.data = {}
+        # cached unit conversion scale from self.units to self.output_units
+        self.__scale_key = None
+        self.__scale = None
+        # cached csv header line
+        self.__header_key = None
+        self.__header = None
+
+    def __output_scale(self):
+        '''
+        Get the unit conversion scale from self.units to self.output_units.
+        The scale is cached on the instance because units rarely change between
+        save_to_file/plot calls.
+        '''
+        key = (tuple(self.units), tuple(self.output_units))
+        if self.__scale_key != key:
+            self.__scale_key = key
+            self.__scale = unit_conversion_scale(self.units, self.output_units)
+        return self.__scale
+
+    def __stacked_data(self):
+        '''
+        Get dict data stacked into one (k, n, m) numpy array so that unit
+        conversion runs as a single ufunc call over all k runs instead of k
+        Python-level iterations. Stacking is only possible when every value
+        in self.data is a 2D numpy array of the same shape: a stack of 1D
+        runs would be scaled along the wrong axis by the last-axis broadcast
+        in convert_unit_ndarray_scalar. The stack is rebuilt on every call:
+        self.data is mutated directly in several places (not only through
+        add_data), so a cached stack could go stale, and keeping it alive
+        would double the resident memory of the dataset.
+        Returns:
+            keys: list of dict keys in stacking order, None if stacking is
+                not possible.
+            stacked: numpy array of size (k, n, m), None if stacking is not
+                possible.
+        '''
+        if not isinstance(self.data, dict) or not self.data:
+            return None, None
+        shape = None
+        for i in self.data:
+            if not isinstance(self.data[i], np.ndarray) or\
+                self.data[i].ndim != 2 or\
+                (shape is not None and self.data[i].shape != shape):
+                return None, None
+            shape = self.data[i].shape
+        keys = list(self.data.keys())
+        return keys, np.stack([self.data[i] for i in keys])
+
+    def __build_header(self, cols):
+        '''
+        Build the csv header line: the name and unit of each column. The
+        result is cached on the instance because it is identical across all
+        files of a multi-run dict.
+        Args:
+            cols: number of columns in each set of data, 0 if data is a scalar
+                or a 1D array.
+        '''
+        key = (cols, tuple(self.output_units),\
+               tuple(self.legend) if self.legend is not None else None)
+        if self.__header_key != key:
+            self.__header_key = key
+            if cols > 0:    # more than one column
+                # column names come from the legend if available
+                if (self.legend is not None) and (cols == len(self.legend)):
+                    names = self.legend
+                else:
+                    names = [self.name + '_' + str(i) for i in range(cols)]
+                units_str = [' (' + self.output_units[i] + ')'\
+                             if i < len(self.output_units) else ''\
+                             for i in range(cols)]
+                self.__header = ','.join(n + u for n, u in zip(names, units_str))
+            else:           # only one column
+                str_unit = ''
+                if len(self.output_units) > 0:
+                    str_unit = ' (' + self.output_units[0] + ')'
+                self.__header = self.name + str_unit
+        return self.__header
 
     def add_data(self, data, key=None, units=None):
         '''
@@ -110,6 +231,14 @@ class Sim_data(object):
                 print(units)
                 print(self.units)
                 raise ValueError('Units are of different lengths.')
+        # cast to the storage dtype if one is specified
+        if self.dtype is not None:
+            if isinstance(data, dict):
+                for i in data:
+                    if isinstance(data[i], np.ndarray):
+                        data[i] = data[i].astype(self.dtype, copy=False)
+            elif isinstance(data, np.ndarray):
+                data = data.astype(self.dtype, copy=False)
         # add data into the manager
         if key is None:
             self.data = data
@@ -118,55 +247,84 @@ class Sim_data(object):
                 self.data = {}
             self.data[key] = data
 
-    def save_to_file(self, data_dir):
+    def save_to_file(self, data_dir, fmt='csv'):
         '''
         Save self.data to files.
         Args:
             data_dir: directory for the data files.
+            fmt: file format.
+                'csv': one text file per set of data, with a header line.
+                'npy': one binary numpy file per set of data. This skips all
+                    float formatting/parsing and is much faster for large
+                    simulations.
+                'hdf5': all sets of data as datasets of one .h5 file. This
+                    needs the optional h5py package.
         '''
-        #### generate header
-        # how many columns in each set of data? 0 if scalar
-        cols = 0
-        if isinstance(self.data, dict):
-            for i in self.data:
-                if self.data[i].ndim > 1:
-                    cols = self.data[i].shape[1]
-                break   # each set of data in data should have the same number of columns
-        elif isinstance(self.data, np.ndarray):
-            if self.data.ndim > 1:
-                cols = self.data.shape[1]
-        # add the name and unit of each column to header
-        header_line = ''
-        if cols > 0:    # more than one column
-            for i in range(cols):
-                # units
-                str_unit = ''
-                if i < len(self.output_units):
-                    str_unit = ' (' + self.output_units[i] + ')'
-                # add a column
-                if (self.legend is not None) and (cols == len(self.legend)):    # legend available
-                    header_line += self.legend[i] + str_unit + ','
-                else:                           # legend not available
-                    header_line += self.name + '_' + str(i) + str_unit + ','
-            # remove the trailing ','
-            header_line = header_line[0:-1]
-        else:           # only one column
-            str_unit = ''
-            if len(self.output_units) > 0:
-                str_unit = ' (' + self.output_units[0] + ')'
-            header_line = self.name + str_unit
-        #### save data and header to .csv files
+        if fmt not in ('csv', 'npy', 'hdf5'):
+            raise ValueError('Unsupported file format: %s.'% fmt)
+        #### convert data to output units
+        scale = self.__output_scale()
+        conv_scale = None   # scale the writers still have to apply, if any
         if isinstance(self.data, dict):
-            for i in self.data:
-                file_name = data_dir + '//' + self.name + '-' + str(i) + '.csv'
-                np.savetxt(file_name,\
-                           convert_unit(self.data[i], self.units, self.output_units),\
-                           header=header_line, delimiter=',', comments='')
+            suffixes = []
+            arrays = []
+            # if a conversion is needed and all runs have the same shape,
+            # convert all of them in one stacked ufunc call
+            stacked_keys = None
+            if scale is not None:
+                stacked_keys, stacked = self.__stacked_data()
+            if stacked_keys is not None:
+                # the stack built above is a private copy already, convert it
+                # in place instead of allocating a second (k, n, m) array
+                converted = convert_unit(stacked, self.units, self.output_units,\
+                                         scale=scale, copy=False)
+                suffixes = ['-' + str(i) for i in stacked_keys]
+                arrays = [converted[idx] for idx in range(len(stacked_keys))]
+            else:
+                # runs of different shapes are converted one by one, right
+                # before each write, so only one converted run per writer is
+                # alive at a time
+                conv_scale = scale
+                for i in self.data:
+                    suffixes.append('-' + str(i))
+                    arrays.append(self.data[i])
         else:
-            file_name = data_dir + '//' + self.name + '.csv'
-            np.savetxt(file_name,\
-                       convert_unit(self.data, self.units, self.output_units),\
-                       header=header_line, delimiter=',', comments='')
+            suffixes = ['']
+            arrays = [convert_unit(self.data, self.units, self.output_units,\
+                                   scale=scale)]
+        #### save data to files
+        if fmt == 'csv':
+            # how many columns in each set of data? 0 if scalar
+            cols = 0
+            if isinstance(self.data, dict):
+                for i in self.data:
+                    if self.data[i].ndim > 1:
+                        cols = self.data[i].shape[1]
+                    break   # each set of data in data should have the same number of columns
+            elif isinstance(self.data, np.ndarray):
+                if self.data.ndim > 1:
+                    cols = self.data.shape[1]
+            # add the name and unit of each column to header
+            header_line = self.__build_header(cols)
+            file_names = [data_dir + '//' + self.name + sfx + '.csv'\
+                          for sfx in suffixes]
+            _write_csv_many(file_names, arrays, header_line, scale=conv_scale)
+        elif fmt == 'npy':
+            for sfx, arr in zip(suffixes, arrays):
+                if conv_scale is not None:
+                    arr = convert_unit_ndarray_scalar(arr, conv_scale)
+                np.save(data_dir + '//' + self.name + sfx + '.npy',\
+                        np.asarray(arr))
+        else:   # hdf5
+            try:
+                import h5py
+            except ImportError:
+                raise ImportError('h5py is required to save data in hdf5 format.')
+            with h5py.File(data_dir + '//' + self.name + '.h5', 'w') as fp:
+                for sfx, arr in zip(suffixes, arrays):
+                    if conv_scale is not None:
+                        arr = convert_unit_ndarray_scalar(arr, conv_scale)
+                    fp.create_dataset(self.name + sfx, data=np.asarray(arr))
 
     def plot(self, x, key=None, plot3d=0, mpl_opt=''):
         '''
@@ -195,6 +353,20 @@ class Sim_data(object):
         '''
         if key == []:
             key = self.data.keys()
+        # the unit conversion scale is the same for all keys, get it once
+        # before the loop instead of recomputing it per key
+        scale = self.__output_scale()
+        # if a conversion is needed and all runs have the same shape, convert
+        # all of them in one stacked ufunc call before the loop
+        stacked_keys = None
+        if scale is not None:
+            stacked_keys, stacked = self.__stacked_data()
+            if stacked_keys is not None:
+                # the stack built above is a private copy already, convert it
+                # in place instead of allocating a second (k, n, m) array
+                converted = convert_unit(stacked, self.units, self.output_units,\
+                                         scale=scale, copy=False)
+                stacked_idx = dict(zip(stacked_keys, range(len(stacked_keys))))
         for i in key:
             y_data = self.data[i]
             # x axis
@@ -206,7 +378,11 @@ class Sim_data(object):
             else:
                 x_data = x.data
             # unit conversion
-            y_data = convert_unit(y_data, self.units, self.output_units)
+            if stacked_keys is not None:
+                y_data = converted[stacked_idx[i]]
+            else:
+                y_data = convert_unit(y_data, self.units, self.output_units,\
+                                      scale=scale)
             # plot
             if plot3d == 1:
                 plot3d_in_one_figure(y_data,\
@@ -251,7 +427,8 @@ class Sim_data(object):
         # y axis
         y_data = self.data
         # unit conversion
-        y_data = convert_unit(y_data, self.units, self.output_units)
+        y_data = convert_unit(y_data, self.units, self.output_units,\
+                              scale=self.__output_scale())
         # plot
         if plot3d == 1:
             plot3d_in_one_figure(y_data,\
@@ -275,77 +452,204 @@ class Sim_data(object):
                             legend=self.legend,\
                             mpl_opt=mpl_opt)
 
-def convert_unit(data, src_unit, dst_unit):
+def _write_csv(file_name, data, header_line):
+    '''
+    Write one set of data to a .csv file through a large write buffer so rows
+    formatted by np.savetxt are flushed to disk in big chunks instead of many
+    small writes.
+    Args:
+        file_name: full path of the .csv file.
+        data: a scalar or a numpy array of size (n,) or (n,m).
+        header_line: header string, written as the first line of the file.
+    '''
+    with open(file_name, 'wb', buffering=4*1024*1024) as fp:
+        if hasattr(os, 'posix_fadvise'):
+            # hint the kernel that the file is written sequentially
+            os.posix_fadvise(fp.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        fp.write((header_line + '\n').encode('utf-8'))
+        arr = np.asarray(data)
+        # float32 carries ~7 significant digits, do not format more
+        fmt = '%.7g' if arr.dtype == np.float32 else '%.18e'
+        np.savetxt(fp, arr, fmt=fmt, delimiter=',', comments='')
+
+# per-thread conversion buffer of _convert_write_csv
+_csv_buf = threading.local()
+
+def _convert_write_csv(file_name, data, scale, header_line):
+    '''
+    Convert one set of data and write it to a .csv file. The conversion
+    happens here, in the writer, so that at most one converted run per
+    writer thread is alive at a time. Each thread reuses one conversion
+    buffer across runs of the same shape instead of allocating per run.
+    Args:
+        file_name: full path of the .csv file.
+        data: a scalar or a numpy array of size (n,) or (n,m).
+        scale: unit conversion scale to apply before writing, None if data
+            needs no conversion.
+        header_line: header string, written as the first line of the file.
+    '''
+    if scale is not None:
+        if isinstance(data, np.ndarray):
+            buf = getattr(_csv_buf, 'buf', None)
+            if buf is None or buf.shape != data.shape or buf.dtype != data.dtype:
+                buf = np.empty_like(data)
+                _csv_buf.buf = buf
+            # the pool already provides coarse parallelism, and calling the
+            # parallel numba kernel from worker threads hangs at shutdown
+            data = convert_unit_ndarray_scalar(data, scale, out=buf,\
+                                               use_jit=False)
+        else:
+            data = convert_unit_ndarray_scalar(data, scale)
+    _write_csv(file_name, data, header_line)
+
+def _write_csv_many(file_names, arrays, header_line, scale=None):
     '''
-    Unit conversion. Notice not to change values in data
+    Write multiple sets of data to .csv files, one file per set. Files are
+    written concurrently by a small thread pool: np.savetxt spends most of
+    its time formatting rows and writing, during which the GIL is regularly
+    released, so formatting and I/O of different files overlap.
+    Args:
+        file_names: a list of full paths of the .csv files.
+        arrays: a list (or iterable) of numpy arrays, same length as file_names.
+        header_line: header string, written as the first line of every file.
+        scale: unit conversion scale the writers apply to each set of data
+            right before writing, None if the data need no conversion.
+    '''
+    if len(file_names) <= 1:
+        for i, file_name in enumerate(file_names):
+            _convert_write_csv(file_name, arrays[i], scale, header_line)
+        return
+    max_workers = min(8, len(file_names), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(_convert_write_csv, file_names, arrays,\
+                          [scale] * len(file_names),\
+                          [header_line] * len(file_names)))
+
+def convert_unit(data, src_unit, dst_unit, scale=None, copy=True):
+    '''
+    Unit conversion.
     Args:
         data: convert data units from src_unit to dst_unit. Data should be a scalar,
             a numpy array of size(n,) or (n,m). n is data length, m is data dimension.
         src_unit: a list of unit of the data.
         dst_unit: a list of unit we want to convert the data to.
+        scale: precomputed unit conversion scale from src_unit to dst_unit. If this
+            is None, the scale is computed from src_unit and dst_unit.
+        copy: True to leave data untouched and return a converted copy. False
+            allows converting numpy arrays in place, which avoids the copy when
+            the caller does not reuse the data afterwards.
     Returns:
-        x: data after unit conversion.
+        x: data after unit conversion. If no conversion is needed, data is
+            returned as is, without copying.
     '''
-    scale = unit_conversion_scale(src_unit, dst_unit)
+    # fast path, no conversion needed
+    if list(src_unit) == list(dst_unit):
+        return data
+    if scale is None:
+        scale = unit_conversion_scale(src_unit, dst_unit)
+    if scale is None or not scale.any():
+        return data
     # unit conversion
-    x = data.copy() # avoid changing values in data
-    if isinstance(x, dict):
-        for i in x:
-            x[i] = convert_unit_ndarray_scalar(x[i], scale)
-    else:
-        x = convert_unit_ndarray_scalar(x, scale)
-    return x
+    if isinstance(data, dict):
+        x = {}
+        for i in data:
+            x[i] = convert_unit_ndarray_scalar(data[i], scale, copy=copy)
+        return x
+    return convert_unit_ndarray_scalar(data, scale, copy=copy)
 
 def unit_conversion_scale(src_unit, dst_unit):
     '''
-    Calculate unit conversion scale.
+    Calculate unit conversion scale. A scale of 0.0 means the corresponding
+    column needs no conversion (same unit, or the conversion is not supported).
+    If no column needs conversion at all, None is returned.
+    '''
+    return _scale_cached(tuple(src_unit), tuple(dst_unit))
+
+@functools.lru_cache(maxsize=64)
+def _scale_cached(src_unit, dst_unit):
+    '''
+    Cached core of unit_conversion_scale, keyed by the unit tuples. The
+    returned array is marked read-only because it is shared between calls.
     '''
     m = len(dst_unit)
-    scale = np.ones((m,))
+    # map unit strings to integer codes once, then get all scales with a
+    # single 2D table lookup instead of comparing strings per column
+    src_codes = np.fromiter((_UNIT_CODE.get(u, 0) for u in src_unit),\
+                            dtype=np.intp, count=m)
+    dst_codes = np.fromiter((_UNIT_CODE.get(u, 0) for u in dst_unit),\
+                            dtype=np.intp, count=m)
+    scale = _SCALE_TBL[src_codes, dst_codes]
     for i in range(m):
-        # deg to rad
-        if src_unit[i] == 'deg' and dst_unit[i] == 'rad':
-            scale[i] = attitude.D2R
-        elif src_unit[i] == 'deg/s' and dst_unit[i] == 'rad/s':
-            scale[i] = attitude.D2R
-        elif src_unit[i] == 'deg/hr' and dst_unit[i] == 'rad/s':
-            scale[i] = attitude.D2R / 3600.0
-        # rad to deg
-        elif src_unit[i] == 'rad' and dst_unit[i] == 'deg':
-            scale[i] = 1.0 / attitude.D2R
-        elif src_unit[i] == 'rad/s' and dst_unit[i] == 'deg/s':
-            scale[i] = 1.0 / attitude.D2R
-        elif src_unit[i] == 'rad/s' and dst_unit[i] == 'deg/hr':
-            scale[i] = 3600.0 / attitude.D2R
-        else:
-            if src_unit[i] != dst_unit[i]:
-                print('Cannot convert unit from %s in %s to %s.'\
-                      % (src_unit[i], src_unit, dst_unit[i]))
+        if scale[i] == 0.0 and src_unit[i] != dst_unit[i]:
+            print('Cannot convert unit from %s in %s to %s.'\
+                  % (src_unit[i], src_unit, dst_unit[i]))
+    if not scale.any():
+        return None
+    scale.setflags(write=False)
     return scale
 
-def convert_unit_ndarray_scalar(x, scale):
+def convert_unit_ndarray_scalar(x, scale, copy=True, out=None, use_jit=True):
     '''
     Unit conversion of numpy array or a scalar.
     Args:
         x: convert x units from src_unit to dst_unit. x should be a scalar,
             a numpy array of size(n,) or (n,m). n is x length, m is x dimension.
-        scale: 1D numpy array of unit convertion scale. x = x * scale
+        scale: 1D numpy array of unit convertion scale. x = x * scale.
+            A zero scale means the corresponding column needs no conversion.
+        copy: True to leave x untouched and return a converted copy. False to
+            convert numpy arrays in place.
+        out: optional preallocated array of the same shape as x to hold the
+            result. If given, it overrides copy so callers can reuse one
+            buffer across many conversions.
+        use_jit: False disables the numba kernel for this call. Callers that
+            already run in worker threads must set this: numba's parallel
+            runtime is not safe to enter from multiple Python threads and can
+            hang the process at interpreter shutdown.
     Returns:
         x: x after unit conversion.
     '''
     m = scale.shape[0]
     if isinstance(x, np.ndarray):
-        if x.ndim == 2:
-            for i in range(min(m, x.shape[1])):
-                if scale[i] != 1.0:
-                    x[:, i] = x[:, i] * scale[i]
+        if x.ndim == 2 or x.ndim == 3:
+            n_col = min(m, x.shape[-1])
+            if out is None:
+                out = np.empty_like(x) if copy else x
+            if njit is not None and use_jit and x.ndim == 2\
+                and x.size > _JIT_MIN_SIZE and out.flags['C_CONTIGUOUS']:
+                # compiled parallel kernel for large arrays
+                if out is not x:
+                    out[...] = x
+                _scale_2d_jit(out, scale[0:n_col])
+            else:
+                # one broadcast multiply over all columns instead of a Python
+                # loop. zero scales (columns that need no conversion) are
+                # replaced with 1.0, and scale is padded with 1.0 if the array
+                # has more columns. a (k, n, m) array stacking k runs of (n, m)
+                # data is converted in the same single pass, scale applies to
+                # the last axis.
+                eff = np.ones((x.shape[-1],))
+                eff[0:n_col] = np.where(scale[0:n_col] == 0.0, 1.0, scale[0:n_col])
+                # keep the multiply in the storage dtype, float32 data should
+                # not be promoted to float64 for the conversion
+                if x.dtype == np.float32:
+                    eff = eff.astype(np.float32)
+                np.multiply(x, eff, out=out)
+            x = out
         elif x.ndim == 1:
             if len(x) == m:
-                x = x * scale
-            else:
-                x = x * scale[0]
+                eff = np.where(scale == 0.0, 1.0, scale)
+                if out is None:
+                    out = np.empty_like(x) if copy else x
+                np.multiply(x, eff, out=out)
+                x = out
+            elif scale[0] != 0.0:
+                if out is None:
+                    out = np.empty_like(x) if copy else x
+                np.multiply(x, scale[0], out=out)
+                x = out
     elif isinstance(x, (int, float)):
-        x = x * scale[0]
+        if scale[0] != 0.0:
+            x = x * scale[0]
     else:
         raise ValueError('Input x should be a scalar, 1D or 2D array, ndim = %s'% x.ndim)
     return x
@@ -365,6 +669,14 @@ def plot_in_one_figure(x, y, logx=False, logy=False,\
         gird: if this is not 'off', it will be changed to 'on'
         legend: tuple or list of strings of length m.
     '''
+    # matplotlib is imported on first use so that importing this module, e.g.
+    # for save_to_file only, does not pay the multi-second pyplot import
+    import matplotlib.pyplot as plt
+    # path simplification makes the Agg renderer skip line vertices that do
+    # not change the rendered result, as recommended by matplotlib for long
+    # time series
+    plt.rcParams['path.simplify'] = True
+    plt.rcParams['path.simplify_threshold'] = 1.0
     # create figure and axis
     fig = plt.figure(title)
     axis = fig.add_subplot(111)
@@ -372,19 +684,54 @@ def plot_in_one_figure(x, y, logx=False, logy=False,\
     # if not x data, generate default x data
     if x is None:
         x = np.array(range(y.shape[0]))
-    try:
-        dim = y.ndim
-        if dim == 1:
-            if logx and logy:   # loglog
-                line, = axis.loglog(x, y, mpl_opt)
-            elif logx:          # semilogx
-                line, = axis.semilogx(x, y, mpl_opt)
-            elif logy:          # semilogy
-                line, = axis.semilogy(x, y, mpl_opt)
-            else:               # plot
-                line, = axis.plot(x, y, mpl_opt)
-            lines.append(line)
-        elif dim == 2:
+    # validate input shapes up front instead of wrapping the plot calls in a
+    # broad try/except
+    if y.ndim not in (1, 2):
+        raise ValueError('y-axis data should be a 1D or 2D array, shape: %s.'\
+                         % (y.shape,))
+    if x.ndim >= 1 and x.shape[0] != y.shape[0]:
+        raise ValueError('x-axis and y-axis data lengths mismatch: %s vs %s.'\
+                         % (x.shape, y.shape))
+    # decimate long time series before rendering. A line cannot show more
+    # detail than the horizontal pixels of the figure, so keep about two
+    # samples per pixel and let matplotlib draw far fewer vertices. Index-
+    # linear subsampling only spreads evenly over a linear x axis; on a log
+    # x axis (e.g. Allan variance over tau) it would starve the left decades,
+    # so such data are plotted unchanged.
+    target = int(fig.get_size_inches()[0] * fig.dpi) * 2
+    if not logx and y.ndim >= 1 and x.ndim >= 1 and\
+        y.shape[0] > 2*target and x.shape[0] == y.shape[0]:
+        idx = np.linspace(0, y.shape[0]-1, target).astype(int)
+        x = x[idx]
+        y = y[idx]
+    dim = y.ndim
+    if dim == 1:
+        if logx and logy:   # loglog
+            line, = axis.loglog(x, y, mpl_opt)
+        elif logx:          # semilogx
+            line, = axis.semilogx(x, y, mpl_opt)
+        elif logy:          # semilogy
+            line, = axis.semilogy(x, y, mpl_opt)
+        else:               # plot
+            line, = axis.plot(x, y, mpl_opt)
+        lines.append(line)
+    else:
+        if not logx and not logy and mpl_opt == '' and y.shape[1] > 1:
+            # draw all columns as one LineCollection, which the renderer
+            # handles as a single batched artist instead of one Line2D per
+            # column. Log axes and user format strings are not supported
+            # by LineCollection and use the per-column path below.
+            from matplotlib.collections import LineCollection
+            from matplotlib.lines import Line2D
+            colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+            colors = [colors[i % len(colors)] for i in range(y.shape[1])]
+            segs = [np.column_stack((x, y[:, i])) for i in range(y.shape[1])]
+            axis.add_collection(LineCollection(segs, colors=colors))
+            axis.autoscale_view()
+            # proxy artists so the legend can still label each column
+            for i in range(y.shape[1]):
+                lines.append(Line2D([0], [0], color=colors[i]))
+        else:
             for i in range(0, y.shape[1]):
                 if logx and logy:   # loglog
                     line, = axis.loglog(x, y[:, i], mpl_opt)
@@ -395,12 +742,6 @@ def plot_in_one_figure(x, y, logx=False, logy=False,\
                 else:               # plot
                     line, = axis.plot(x, y[:, i], mpl_opt)
                 lines.append(line)
-        else:
-            raise ValueError
-    except:
-        print('x-axis data len: ', x.shape)
-        print('y-axis data shape: ', y.shape)
-        raise ValueError('Check input data y.')
     # label
     if xlabel is not None:
         plt.xlabel(xlabel)
@@ -422,21 +763,16 @@ def plot3d_in_one_figure(y, title='Figure', grid='on', legend=None, mpl_opt=''):
         gird: if this is not 'off', it will be changed to 'on'
         legend: tuple or list of strings of length 3.
     '''
+    # y must be an numpy array of size (n,3)
+    if y.ndim != 2 or y.shape[1] != 3:
+        raise ValueError('y-axis data should be an array of size (n,3), shape: %s.'\
+                         % (y.shape,))
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D     # pylint: disable=unused-import
     # create figure and axis
     fig = plt.figure(title)
     axis = fig.add_subplot(111, projection='3d', aspect='equal')
-    try:
-        dim = y.ndim
-        if dim == 2:    # y must be an numpy array of size (n,3), dim=2
-            if y.shape[1] != 3:
-                raise ValueError
-            else:
-                axis.plot(y[:, 0], y[:, 1], y[:, 2], mpl_opt)
-        else:
-            raise ValueError
-    except:
-        print(y.shape)
-        raise ValueError('Check input data y.')
+    axis.plot(y[:, 0], y[:, 1], y[:, 2], mpl_opt)
     # label
     if isinstance(legend, (tuple, list)):
         n = len(legend)
@@ -460,46 +796,39 @@ def plot3d_proj_in_one_figure(y, title='Figure', grid='on', legend=None, mpl_opt
         gird: if this is not 'off', it will be changed to 'on'
         legend: tuple or list of strings of length 3.
     '''
-    # plot data
-    try:
-        dim = y.ndim
-        if dim == 2:    # y must be an numpy array of size (n,3), dim=2
-            if y.shape[1] != 3:
-                raise ValueError
-            else:
-                # check label
-                if isinstance(legend, (tuple, list)):
-                    n = len(legend)
-                    if n != 3:
-                        legend = ['x', 'y', 'z']
-                else:
-                    legend = ['x', 'y', 'z']
-                # check grid
-                show_grid = False
-                if grid.lower() != 'off':
-                    show_grid = True
-                # create figure and axis
-                # xy
-                fig = plt.figure(title)
-                axis = fig.add_subplot(131, aspect='equal')
-                axis.plot(y[:, 0], y[:, 1], mpl_opt)
-                axis.set_xlabel(legend[0])
-                axis.set_ylabel(legend[1])
-                axis.grid(show_grid)
-                # xz
-                axis = fig.add_subplot(132, aspect='equal')
-                axis.plot(y[:, 0], y[:, 2], mpl_opt)
-                axis.set_xlabel(legend[0])
-                axis.set_ylabel(legend[2])
-                axis.grid(show_grid)
-                # yz
-                axis = fig.add_subplot(133, aspect='equal')
-                axis.plot(y[:, 1], y[:, 2], mpl_opt)
-                axis.set_xlabel(legend[1])
-                axis.set_ylabel(legend[2])
-                axis.grid(show_grid)
-        else:
-            raise ValueError
-    except:
-        print(y.shape)
-        raise ValueError('Check input data y.')
+    # y must be an numpy array of size (n,3)
+    if y.ndim != 2 or y.shape[1] != 3:
+        raise ValueError('y-axis data should be an array of size (n,3), shape: %s.'\
+                         % (y.shape,))
+    import matplotlib.pyplot as plt
+    # check label
+    if isinstance(legend, (tuple, list)):
+        n = len(legend)
+        if n != 3:
+            legend = ['x', 'y', 'z']
+    else:
+        legend = ['x', 'y', 'z']
+    # check grid
+    show_grid = False
+    if grid.lower() != 'off':
+        show_grid = True
+    # create figure and axis
+    # xy
+    fig = plt.figure(title)
+    axis = fig.add_subplot(131, aspect='equal')
+    axis.plot(y[:, 0], y[:, 1], mpl_opt)
+    axis.set_xlabel(legend[0])
+    axis.set_ylabel(legend[1])
+    axis.grid(show_grid)
+    # xz
+    axis = fig.add_subplot(132, aspect='equal')
+    axis.plot(y[:, 0], y[:, 2], mpl_opt)
+    axis.set_xlabel(legend[0])
+    axis.set_ylabel(legend[2])
+    axis.grid(show_grid)
+    # yz
+    axis = fig.add_subplot(133, aspect='equal')
+    axis.plot(y[:, 1], y[:, 2], mpl_opt)
+    axis.set_xlabel(legend[1])
+    axis.set_ylabel(legend[2])
+    axis.grid(show_grid)